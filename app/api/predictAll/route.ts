@@ -56,9 +56,13 @@ export async function POST(req: Request) {
 
     const fastApiUrl = `${base.replace(/\/$/, "")}/predictAll`;
 
+    // Grid cells yield to the clicked point when the model server is busy
+    const source = String(body?.source ?? "");
+    const priority = source.includes("grid") ? "grid" : source.startsWith("scheduled") ? "background" : "user";
+
     const res = await fetch(fastApiUrl, {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
+      headers: { "Content-Type": "application/json", "X-Priority": priority },
       body: JSON.stringify(body),
     });
 
@@ -66,8 +70,10 @@ export async function POST(req: Request) {
 
     if (!res.ok) {
       console.error("FastAPI error:", text);
+      const retryAfter = res.headers.get("Retry-After");
       return new Response(JSON.stringify({ error: "Prediction failed", details: text }), {
         status: res.status,
+        headers: retryAfter ? { "Retry-After": retryAfter } : undefined,
       });
     }
 
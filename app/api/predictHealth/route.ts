@@ -78,6 +78,8 @@ export async function POST(req: Request) {
     }
 
     if (!fastApiRes.ok) {
+      // Keep Retry-After from the model server's 429/503 so clients can back off
+      const retryAfter = fastApiRes.headers.get("Retry-After");
       return NextResponse.json(
         {
           error: data?.error || "FastAPI error",
@@ -85,7 +87,7 @@ export async function POST(req: Request) {
           data,
           fastApiUrl: FASTAPI_URL,
         },
-        { status: fastApiRes.status }
+        { status: fastApiRes.status, headers: retryAfter ? { "Retry-After": retryAfter } : undefined }
       );
     }
 
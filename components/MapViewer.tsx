@@ -83,6 +83,19 @@ function toDMS(dec: number): string {
   return `${deg}° ${min}' ${sec}"`;
 }
 
+// Model server sheds grid traffic under load (429/503 + Retry-After)
+function isShed(res: Response) {
+  return res.status === 429 || res.status === 503;
+}
+
+function retryAfterMs(res: Response) {
+  const secs = Number(res.headers.get("Retry-After"));
+  return Math.min(Number.isFinite(secs) && secs > 0 ? secs : 1, 5) * 1000;
+}
+
+// Total time one click may spend waiting to retry shed grid cells
+const GRID_RETRY_BUDGET_MS = 5000;
+
 export default function MapViewer({
   setWeather,
   setSpreadDetails,
@@ -158,17 +171,20 @@ export default function MapViewer({
         const userID = auth.currentUser?.uid ?? null;
 
         // ---------------------------------------------
-        // 25-GRID PREDICTION LOOP
+        // 25-GRID PREDICTION LOOP (center = user's click goes first)
         // ---------------------------------------------
+        const cells: { gridLat: number; gridLon: number; isCenter: boolean }[] = [];
         for (let i = -2; i <= 2; i++) {
           for (let j = -2; j <= 2; j++) {
-            const gridLat = lat + i * delta;
-            const gridLon = lon + j * delta;
-            const isCenter = i === 0 && j === 0;
-
-            const source = isCenter ? "user_clicked_point" : "user_click_remaining_grid";
+            cells.push({ gridLat: lat + i * delta, gridLon: lon + j * delta, isCenter: i === 0 && j === 0 });
+          }
+        }
+        cells.sort((a, b) => Number(b.isCenter) - Number(a.isCenter));
 
-            const res = await fetch("/api/predictAll", {
+        let retryBudgetMs = GRID_RETRY_BUDGET_MS;
+        for (const { gridLat, gridLon, isCenter } of cells) {
+          const predict = () =>
+            fetch("/api/predictAll", {
               method: "POST",
               headers: { "Content-Type": "application/json" },
               body: JSON.stringify({
@@ -184,29 +200,41 @@ export default function MapViewer({
               }),
             });
 
-            if (!res.ok) throw new Error("Prediction failed");
-
-            const data = await res.json();
-            const { risk_level, spread_distance_km } = data;
+          let res = await predict();
+
+          // A shed grid cell shouldn't sink the whole click: retry once while the
+          // click's retry budget lasts, otherwise leave the cell out
+          if (!isCenter && isShed(res)) {
+            const waitMs = retryAfterMs(res);
+            if (waitMs > retryBudgetMs) continue;
+            retryBudgetMs -= waitMs;
+            await new Promise((resolve) => setTimeout(resolve, waitMs));
+            res = await predict();
+            if (isShed(res)) continue;
+          }
 
-            if (isCenter) {
-              setSpreadDetails({
-                riskLevel: risk_level,
-                spreadDistance: `${spread_distance_km} km`,
-              });
-            }
+          if (!res.ok) throw new Error("Prediction failed");
 
-            function riskToIntensity(risk: string) {
-              if (risk === "High") return 0.9;
-              if (risk === "Medium") return 0.5;
-              return 0.2; // Low (default)
-            }
+          const data = await res.json();
+          const { risk_level, spread_distance_km } = data;
 
-            // Heatmap intensity
-            let intensity = riskToIntensity(risk_level);
+          if (isCenter) {
+            setSpreadDetails({
+              riskLevel: risk_level,
+              spreadDistance: `${spread_distance_km} km`,
+            });
+          }
 
-            newPoints.push([gridLat, gridLon, intensity]);
+          function riskToIntensity(risk: string) {
+            if (risk === "High") return 0.9;
+            if (risk === "Medium") return 0.5;
+            return 0.2; // Low (default)
           }
+
+          // Heatmap intensity
+          let intensity = riskToIntensity(risk_level);
+
+          newPoints.push([gridLat, gridLon, intensity]);
         }
 
         // SUCCESS → Update heatmap
@@ -0,0 +1,209 @@
+# admission.py
+# Shared by model_server/ and planthealth-modelserver/ (each deploys on its own,
+# so the file is kept identical in both folders; `npm run check:admission` checks it).
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+
+from starlette.responses import JSONResponse
+
+# Lower number = served first. Clients send X-Priority: user | grid | background
+PRIORITY_USER = 0
+PRIORITY_GRID = 1
+PRIORITY_BACKGROUND = 2
+PRIORITIES = {"user": PRIORITY_USER, "grid": PRIORITY_GRID, "background": PRIORITY_BACKGROUND}
+
+# Non-user traffic is shed (429) once the queue is this full, keeping room for users
+LOW_PRIORITY_QUEUE_SHARE = 0.5
+
+
+class Limit:
+    def __init__(self, max_concurrent, max_queue, timeout, est_seconds=1.0, manual=False):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.timeout = timeout          # default deadline when client sends none
+        self.est_seconds = est_seconds  # starting guess for service time
+        self.manual = manual            # handler admits itself via AdmissionController.slot()
+
+
+class Rejected(Exception):
+    def __init__(self, status_code, reason, retry_after):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Gate:
+    """Concurrency slots + priority wait queue for one endpoint (single event loop)"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.queued = 0
+        self.service_time = limit.est_seconds  # EWMA of observed request time
+        self._waiters = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self.counts = {"admitted": 0, "queue_full": 0, "shed": 0, "deadline": 0}
+
+    def _retry_after(self, ahead):
+        waves = ahead // self.limit.max_concurrent + 1
+        return max(1, math.ceil(waves * self.service_time))
+
+    async def acquire(self, priority, deadline):
+        if self.active < self.limit.max_concurrent and self.queued == 0:
+            self.active += 1
+            self.counts["admitted"] += 1
+            return
+
+        ahead = sum(1 for p, _, fut in self._waiters if p <= priority and not fut.done())
+
+        if self.queued >= self.limit.max_queue:
+            self.counts["queue_full"] += 1
+            raise Rejected(503, "queue_full", self._retry_after(self.queued))
+
+        if priority > PRIORITY_USER and self.queued >= self.limit.max_queue * LOW_PRIORITY_QUEUE_SHARE:
+            self.counts["shed"] += 1
+            raise Rejected(429, "shed_low_priority", self._retry_after(self.queued))
+
+        # Don't queue work that can't finish in time: wait for a slot + our own run
+        remaining = deadline - time.monotonic()
+        start_wait = (ahead // self.limit.max_concurrent + 1) * self.service_time
+        if start_wait + self.service_time > remaining:
+            self.counts["deadline"] += 1
+            raise Rejected(503, "deadline", self._retry_after(ahead))
+
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        self.queued += 1
+
+        try:
+            # Latest useful start is deadline minus expected service time
+            await asyncio.wait_for(asyncio.shield(fut), max(0.0, remaining - self.service_time))
+        except BaseException as e:
+            if fut.done() and not fut.cancelled():
+                # Slot was handed to us just as we gave up; pass it on
+                self.release(None)
+            else:
+                fut.cancel()
+                self.queued -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                self.counts["deadline"] += 1
+                raise Rejected(503, "deadline", self._retry_after(ahead))
+            raise
+
+        self.counts["admitted"] += 1
+
+    def release(self, elapsed):
+        # elapsed=None: don't learn from this request (failed, or did no real work)
+        if elapsed is not None:
+            self.service_time = 0.8 * self.service_time + 0.2 * elapsed
+
+        # Hand the slot straight to the best live waiter; active stays the same
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                self.queued -= 1
+                fut.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "max_concurrent": self.limit.max_concurrent,
+            "max_queue": self.limit.max_queue,
+            "service_time": round(self.service_time, 4),
+            **self.counts,
+        }
+
+
+class AdmissionController:
+    def __init__(self, limits):
+        self.gates = {path: _Gate(limit) for path, limit in limits.items()}
+
+    def stats(self):
+        return {path: gate.stats() for path, gate in self.gates.items()}
+
+    @asynccontextmanager
+    async def slot(self, path, raw_headers):
+        """Admission inside a handler (Limit(manual=True)), e.g. to answer cache
+        hits without queueing. Raises Rejected; see rejected_response().
+        Only a block that exits normally feeds the service-time estimate."""
+        gate = self.gates[path]
+        priority, deadline = _request_params(gate, raw_headers)
+        await gate.acquire(priority, deadline)
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException:
+            gate.release(None)
+            raise
+        gate.release(time.monotonic() - started)
+
+
+def _request_params(gate, raw_headers):
+    """(priority, deadline) from the ASGI header list"""
+    headers = dict(raw_headers)
+    # latin-1 maps every byte, so odd header values just fall back to "user"
+    priority = PRIORITIES.get(headers.get(b"x-priority", b"user").decode("latin-1").strip().lower(), PRIORITY_USER)
+    timeout = gate.limit.timeout
+    try:
+        timeout = min(timeout, float(headers[b"x-request-timeout"]))
+    except (KeyError, ValueError):
+        pass
+    return priority, time.monotonic() + timeout
+
+
+def rejected_response(r):
+    return JSONResponse(
+        {"error": "Server busy", "reason": r.reason, "retry_after": r.retry_after},
+        status_code=r.status_code,
+        headers={"Retry-After": str(r.retry_after)},
+    )
+
+
+class AdmissionMiddleware:
+    """ASGI middleware: the slot is held until the response body (incl. streams) is sent.
+
+    Request headers:
+      X-Priority: user (default) | grid | background
+      X-Request-Timeout: seconds the caller will wait (capped at the endpoint timeout)
+    """
+
+    def __init__(self, app, controller):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        gate = None
+        if scope["type"] == "http" and scope["method"] != "OPTIONS":
+            gate = self.controller.gates.get(scope["path"])
+        if gate is None or gate.limit.manual:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await gate.acquire(*_request_params(gate, scope["headers"]))
+        except Rejected as r:
+            await rejected_response(r)(scope, receive, send)
+            return
+
+        status = {}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Fast 4xx/5xx answers would drag the estimate below real service time
+            ok = 200 <= status.get("code", 500) < 300
+            gate.release(time.monotonic() - started if ok else None)
@@ -5,11 +5,20 @@ import numpy as np
 from notifications import save_prediction_to_firestore, create_ai_alert
 from fastapi.middleware.cors import CORSMiddleware
 from firebase_app import db
+from admission import AdmissionController, AdmissionMiddleware, Limit
 
 app = FastAPI()
 model = joblib.load("spread_model.pkl") #risk level model
 spread_model = joblib.load("area_spread_model.pkl")  # distance/direction model
 
+# Per-endpoint concurrency/queue caps; grid cells send X-Priority: grid
+admission = AdmissionController({
+    "/predict": Limit(max_concurrent=8, max_queue=32, timeout=15, est_seconds=0.05),
+    "/predictSpread": Limit(max_concurrent=8, max_queue=32, timeout=15, est_seconds=0.05),
+    "/predictAll": Limit(max_concurrent=8, max_queue=64, timeout=15, est_seconds=0.3),
+})
+app.add_middleware(AdmissionMiddleware, controller=admission)  # added before CORS so 429/503 still get CORS headers
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],           # for testing
@@ -30,6 +39,10 @@ class InputPoint(BaseModel):
     createAlert: bool = False            # create notification?
 
 
+@app.get("/admissionStats")
+def admission_stats():
+    return admission.stats()
+
 @app.post("/predict")
 def predict_spread(point: InputPoint):
     print("Received input:", point.dict())  # ✅ Debug log
@@ -1,3 +1,4 @@
+# Offline export script (needs torch, timm and ultralytics; not part of the server requirements)
 import torch
 import timm
 from ultralytics import YOLO
@@ -22,6 +23,7 @@ torch.onnx.export(
     opset_version=17,  # <--- Changed this from 11 to 17 for better compatibility
     input_names=['input'],
     output_names=['output'],
+    dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}},  # lets main.py classify crops in batches
     do_constant_folding=True
 )
 print("Done! You now have both .onnx files.")
\ No newline at end of file
@@ -1,25 +1,32 @@
-from fastapi import FastAPI, File, UploadFile
+from fastapi import FastAPI, File, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from ultralytics import YOLO
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from PIL import Image
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
 import io
+import json
+import math
 import os
+import queue
+import tempfile
+import threading
 import numpy as np
 import onnxruntime as ort
+from result_cache import ResultCache, file_fingerprint
+from admission import AdmissionController, AdmissionMiddleware, Limit, Rejected, rejected_response
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
 
 # --------------------
 # App init
 # --------------------
 app = FastAPI()
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
 # --------------------
 # Paths (Updated to ONNX)
 # --------------------
@@ -31,21 +38,99 @@ CLF_PATH = os.path.join(BASE_DIR, "leaf_classifier.onnx")
 # --------------------
 # Load models ONCE
 # --------------------
-# YOLO handles ONNX natively via ultralytics
-detector = YOLO(DET_PATH)
+# YOLO detector exported to ONNX, run with onnxruntime directly (sessions live in the detector pool below)
 DET_CONF = 0.35
+DET_IOU = 0.7            # ultralytics' default NMS IoU for predict()
+DET_MAX = 300            # ultralytics' default max_det
 MIN_BOX_SIZE = 12
 MIN_CLASS_CONF = 0.6
 
+# --------------------
+# Tiled inference (optional, for large field photos)
+# --------------------
+TILE_SIZE = 640          # matches the detector export size
+TILE_OVERLAP = 0.2       # fraction of a tile shared with its neighbour
+TILE_BATCH = 4           # tiles handed to one worker at a time
+TILE_MAX_SIDE = 4096     # larger photos are downscaled while decoding
+MAX_DECODE_PIXELS = int(os.getenv("MAX_DECODE_PIXELS", 40_000_000))  # ~120 MB as RGB
+
+# load_image() enforces MAX_DECODE_PIXELS from the header and shrinks JPEGs while
+# decoding, so PIL's own bomb check would only turn big-but-fine JPEGs into 500s
+Image.MAX_IMAGE_PIXELS = None
+NMS_IOU = 0.5
+NMS_IOS = 0.6            # cross-tile: intersection over the smaller box (cut-off vs full leaf)
+
+# Callers borrow a detector session from a small pool. Each session gets its
+# share of the cores, so instances x threads ~= cores instead of cores^2.
+DETECTOR_INSTANCES = int(os.getenv("DETECTOR_INSTANCES", min(4, os.cpu_count() or 1)))
+DETECTOR_THREADS = max(1, (os.cpu_count() or 1) // DETECTOR_INSTANCES)
+_detector_pool = queue.LifoQueue()
+_detector_count = 0
+_detector_lock = threading.Lock()
+
+# More tile workers than detectors would only queue on the pool
+TILE_WORKERS = DETECTOR_INSTANCES
+tile_pool = ThreadPoolExecutor(max_workers=TILE_WORKERS, thread_name_prefix="tile")
+
 # ONNX Runtime session for the classifier
 clf_session = ort.InferenceSession(CLF_PATH, providers=['CPUExecutionProvider'])
+CLF_INPUT_NAME = clf_session.get_inputs()[0].name
+# Older exports have a fixed batch of 1; re-export with convert.py for batching
+CLF_DYNAMIC_BATCH = not isinstance(clf_session.get_inputs()[0].shape[0], int)
+CLF_BATCH = 16
+
+# /predictBatch: images decoded + detected ahead of the one being classified.
+# Workers keep only the leaf crops, so BATCH_LOOKAHEAD images can queue up cheaply.
+BATCH_PREFETCH = 2
+BATCH_LOOKAHEAD = 8
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "1000"))  # files per /predictBatch request
+batch_pool = ThreadPoolExecutor(max_workers=BATCH_PREFETCH, thread_name_prefix="batch")
 
 IDX_TO_LABEL = {1: "diseased", 0: "healthy"}
 
+# --------------------
+# Result cache (repeat uploads of the same photo)
+# --------------------
+MODEL_VERSION = file_fingerprint(DET_PATH, CLF_PATH)
+result_cache = ResultCache(
+    max_entries=int(os.getenv("RESULT_CACHE_SIZE", "256")),
+    ttl=int(os.getenv("RESULT_CACHE_TTL", "3600")),
+    disk_dir=os.getenv("RESULT_CACHE_DIR") or None,
+    max_disk_entries=int(os.getenv("RESULT_CACHE_DISK_SIZE", "4096")),
+)
+
+def cache_key(image_bytes, tiled):
+    # Anything that can change the response for the same bytes goes in the key
+    params = {"model": MODEL_VERSION, "det_conf": DET_CONF,
+              "min_box": MIN_BOX_SIZE, "min_class_conf": MIN_CLASS_CONF, "tiled": tiled}
+    if tiled:
+        params.update({"tile_size": TILE_SIZE, "tile_overlap": TILE_OVERLAP,
+                       "tile_max_side": TILE_MAX_SIDE, "nms_iou": NMS_IOU, "nms_ios": NMS_IOS})
+    return ResultCache.make_key(image_bytes, params)
+
+# --------------------
+# Admission control + CORS (below the detector pool, which sizes /predict)
+# --------------------
+# Inference is CPU bound: one request per pooled detector, short queues, fail fast when full
+admission = AdmissionController({
+    # manual: /predict answers cache hits before taking a slot
+    "/predict": Limit(max_concurrent=DETECTOR_INSTANCES, max_queue=8, timeout=60, est_seconds=2.0, manual=True),
+    "/predictBatch": Limit(max_concurrent=1, max_queue=2, timeout=600, est_seconds=30.0),
+})
+app.add_middleware(AdmissionMiddleware, controller=admission)  # added before CORS so 429/503 still get CORS headers
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
 # --------------------
 # Helper functions
 # --------------------
-def classify_leaf(pil_img):
+def _preprocess_leaf(pil_img):
     """Replaces your torch transforms with manual numpy preprocessing"""
     # 1. Resize (Matches your original transforms.Resize)
     img = pil_img.resize((224, 224))
@@ -58,19 +143,230 @@ def classify_leaf(pil_img):
     mean = np.array([0.485, 0.456, 0.406], dtype=np.float32).reshape(3, 1, 1)
     std = np.array([0.229, 0.224, 0.225], dtype=np.float32).reshape(3, 1, 1)
     
-    img_data = (img_data - mean) / std
-    
-    # Final safety check: ensure input_tensor is float32
-    input_tensor = img_data[np.newaxis, :].astype(np.float32)
+    return ((img_data - mean) / std).astype(np.float32)
 
-    # 3. Run Inference
-    outputs = clf_session.run(None, {clf_session.get_inputs()[0].name: input_tensor})
-    logits = outputs[0]
-    
-    # 4. Softmax & Argmax (Matches your original torch logic)
-    probs = np.exp(logits) / np.sum(np.exp(logits), axis=1)
-    idx = int(np.argmax(probs))
-    return IDX_TO_LABEL[idx], float(probs[0][idx])
+def classify_leaves(crops):
+    """Classify many crops, CLF_BATCH at a time when the model allows it"""
+    step = CLF_BATCH if CLF_DYNAMIC_BATCH else 1
+    preds = []
+    for i in range(0, len(crops), step):
+        # Final safety check: ensure input_tensor is float32
+        input_tensor = np.stack([_preprocess_leaf(c) for c in crops[i:i + step]]).astype(np.float32)
+
+        # 3. Run Inference
+        outputs = clf_session.run(None, {CLF_INPUT_NAME: input_tensor})
+        logits = outputs[0]
+
+        # 4. Softmax & Argmax (Matches your original torch logic)
+        probs = np.exp(logits) / np.sum(np.exp(logits), axis=1, keepdims=True)
+        for row in probs:
+            idx = int(np.argmax(row))
+            preds.append((IDX_TO_LABEL[idx], float(row[idx])))
+    return preds
+
+def _decode_ratio(w, h, max_side=None):
+    """Scale that fits (w, h) into MAX_DECODE_PIXELS and, if given, max_side"""
+    ratio = min(1.0, math.sqrt(MAX_DECODE_PIXELS / (w * h)))
+    if max_side:
+        ratio = min(ratio, max_side / max(w, h))
+    return ratio
+
+def load_image(image_bytes, max_side=None):
+    """Decode upload to RGB within MAX_DECODE_PIXELS (and max_side, if given).
+
+    JPEGs are decoded at reduced scale (PIL draft mode), so huge photos never
+    expand to full size in memory. Other formats can't be, so anything over
+    the budget (size read from the header) is rejected before decoding.
+    Returns (img, scale) where scale maps image coords back to the original.
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    orig_w, orig_h = img.size
+
+    ratio = _decode_ratio(orig_w, orig_h, max_side)
+    target = (max(1, int(orig_w * ratio)), max(1, int(orig_h * ratio)))
+    if ratio < 1:
+        # draft() only shrinks by 1/2, 1/4, 1/8 while both sides stay >= the request,
+        # so an exact target can land one step short; then go one step further
+        # and let thumbnail() scale back up to nothing more than the target.
+        img.draft("RGB", target)  # no-op for non-JPEG
+        if img.size[0] * img.size[1] > MAX_DECODE_PIXELS:
+            img = Image.open(io.BytesIO(image_bytes))
+            img.draft("RGB", (max(1, target[0] // 2), max(1, target[1] // 2)))
+
+    w, h = img.size
+    if w * h > MAX_DECODE_PIXELS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Image is {orig_w}x{orig_h}; please upload at most {MAX_DECODE_PIXELS // 1_000_000} MP.",
+        )
+
+    img = img.convert("RGB")
+    if ratio < 1:
+        img.thumbnail(target)
+
+    return img, orig_w / img.size[0]
+
+def _letterbox(img, size=TILE_SIZE):
+    """Resize keeping aspect and pad to size x size (grey 114), like ultralytics' LetterBox"""
+    w, h = img.size
+    gain = min(size / w, size / h)
+    nw, nh = max(1, round(w * gain)), max(1, round(h * gain))
+    left, top = int(round((size - nw) / 2 - 0.1)), int(round((size - nh) / 2 - 0.1))
+    canvas = Image.new("RGB", (size, size), (114, 114, 114))
+    canvas.paste(img.resize((nw, nh), Image.BILINEAR), (left, top))
+    return canvas, gain, left, top
+
+def _run_detector(session, img, dx=0, dy=0):
+    """One YOLO pass over img -> list of (x1, y1, x2, y2, conf), shifted by (dx, dy)"""
+    canvas, gain, left, top = _letterbox(img)
+    x = (np.asarray(canvas, dtype=np.float32) / 255.0).transpose(2, 0, 1)[np.newaxis]
+    out = session.run(None, {session.get_inputs()[0].name: x})[0][0]
+
+    if out.shape[-1] == 6:
+        # End-to-end export: (max_det, [x1, y1, x2, y2, score, class]), already NMS'd
+        out = out[out[:, 4] > DET_CONF]
+        boxes = out[:, :4]
+        scores = out[:, 4]
+    else:
+        # Classic export: (4 + classes, anchors) of cx, cy, w, h + class scores
+        out = out.T
+        scores = out[:, 4:].max(axis=1)
+        keep = scores > DET_CONF
+        cx, cy, bw, bh = out[keep, :4].T
+        boxes = np.stack([cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2], axis=1)
+        scores = scores[keep]
+
+    # Letterbox coords -> img coords
+    boxes = (boxes - [left, top, left, top]) / gain
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, img.size[0])
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, img.size[1])
+
+    found = [
+        (float(x1) + dx, float(y1) + dy, float(x2) + dx, float(y2) + dy, float(c))
+        for (x1, y1, x2, y2), c in zip(boxes, scores)
+    ]
+    # Single "leaf" class, so class-agnostic NMS matches ultralytics
+    return nms(found, iou_thresh=DET_IOU)[:DET_MAX]
+
+def detect(img):
+    with borrow_detector() as session:
+        return _run_detector(session, img)
+
+def _tile_starts(length, size, stride):
+    if length <= size:
+        return [0]
+    starts = list(range(0, length - size, stride))
+    starts.append(length - size)
+    return starts
+
+def iter_tiles(width, height, size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """Yield overlapping (x1, y1, x2, y2) tiles covering the whole image"""
+    stride = max(1, int(size * (1 - overlap)))
+    xs = _tile_starts(width, size, stride)
+    for y in _tile_starts(height, size, stride):
+        for x in xs:
+            yield (x, y, min(x + size, width), min(y + size, height))
+
+def _load_detector():
+    opts = ort.SessionOptions()
+    opts.intra_op_num_threads = DETECTOR_THREADS
+    opts.inter_op_num_threads = 1
+    return ort.InferenceSession(DET_PATH, sess_options=opts, providers=['CPUExecutionProvider'])
+
+@contextmanager
+def borrow_detector():
+    """Exclusive use of one of at most DETECTOR_INSTANCES detector sessions"""
+    global _detector_count
+    try:
+        model = _detector_pool.get_nowait()
+    except queue.Empty:
+        with _detector_lock:
+            create = _detector_count < DETECTOR_INSTANCES
+            if create:
+                _detector_count += 1
+        try:
+            model = _load_detector() if create else _detector_pool.get()
+        except Exception:
+            if create:
+                with _detector_lock:
+                    _detector_count -= 1
+            raise
+    try:
+        yield model
+    finally:
+        _detector_pool.put(model)
+
+# Load one detector at startup so the first request doesn't pay for it
+with borrow_detector() as _session:
+    DET_SESSION_THREADS = _session.get_session_options().intra_op_num_threads
+
+def _detect_tile_batch(img, tiles):
+    """Returns [(box, tile_idx)] for (tile_idx, tile) pairs"""
+    found = []
+    with borrow_detector() as session:
+        for tile_idx, (x1, y1, x2, y2) in tiles:
+            # Crops are made inside the worker so only in-flight tiles are held in memory
+            tile = img.crop((x1, y1, x2, y2))
+            found.extend((box, tile_idx) for box in _run_detector(session, tile, x1, y1))
+    return found
+
+def nms(boxes, iou_thresh=NMS_IOU, groups=None, ios_thresh=NMS_IOS):
+    """Greedy NMS over (x1, y1, x2, y2, conf) tuples from all tiles.
+
+    With groups (tile index per box), boxes from different tiles are also merged
+    when the overlap covers most of the smaller one: a leaf crossing a tile seam
+    shows up cut off in one tile and whole in the other, and their IoU is low.
+    """
+    if not boxes:
+        return []
+    arr = np.array(boxes, dtype=np.float32)
+    x1, y1, x2, y2, scores = arr.T
+    areas = (x2 - x1) * (y2 - y1)
+    group = np.array(groups) if groups is not None else None
+    order = scores.argsort()[::-1]
+
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        iw = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        ih = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = iw * ih
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        suppress = iou > iou_thresh
+        if group is not None:
+            ios = inter / (np.minimum(areas[i], areas[rest]) + 1e-9)
+            suppress |= (group[rest] != group[i]) & (ios > ios_thresh)
+        order = rest[~suppress]
+
+    return [boxes[i] for i in keep]
+
+def detect_tiled(img):
+    """Run the detector over overlapping tiles, at most TILE_WORKERS batches in flight"""
+    found = []
+    pending = set()
+    batch = []
+
+    def drain(futures):
+        for fut in futures:
+            found.extend(fut.result())
+
+    for tile in enumerate(iter_tiles(*img.size)):
+        batch.append(tile)
+        if len(batch) < TILE_BATCH:
+            continue
+        if len(pending) >= TILE_WORKERS:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            drain(done)
+        pending.add(tile_pool.submit(_detect_tile_batch, img, batch))
+        batch = []
+
+    if batch:
+        pending.add(tile_pool.submit(_detect_tile_batch, img, batch))
+    drain(wait(pending)[0])
+
+    return nms([box for box, _ in found], groups=[idx for _, idx in found])
 
 # Note: Keeping your metrics helpers exactly the same!
 def compute_metrics(healthy: int, diseased: int):
@@ -85,35 +381,32 @@ def compute_metrics(healthy: int, diseased: int):
         "disease_incidence": float(disease_incidence),
     }
 
-# --------------------
-# Routes
-# --------------------
-@app.get("/")
-def root():
-    return {
-        "message": "FLORAI FastAPI running (ONNX Optimized)",
-        "detector": os.path.basename(DET_PATH),
-        "classifier": os.path.basename(CLF_PATH),
-        "conf": DET_CONF,
-    }
-
-@app.get("/health")
-def health():
-    return {"status": "ok"}
+def run_detection(image_bytes, tiled=False):
+    """Decode + detect. Returns (img, boxes, scale)"""
+    # YOLO ONNX; tiled mode keeps small leaves at full resolution on big photos
+    if tiled:
+        img, scale = load_image(image_bytes, max_side=TILE_MAX_SIDE)
+        return img, detect_tiled(img), scale
+    img, scale = load_image(image_bytes)
+    return img, detect(img), scale
 
-@app.post("/predict")
-async def predict(file: UploadFile = File(...)):
-    image_bytes = await file.read()
-    img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+def extract_leaves(img, boxes):
+    """Boxes big enough to classify, and their crops"""
+    usable = [b for b in boxes if (b[2] - b[0]) >= MIN_BOX_SIZE and (b[3] - b[1]) >= MIN_BOX_SIZE]
+    return usable, [img.crop(b[:4]) for b in usable]
 
-    # Using YOLO ONNX
-    results = detector.predict(img, conf=DET_CONF, verbose=False)[0]
+def analyze(img, boxes, scale=1.0):
+    """Classify detected leaves and build the /predict response"""
+    usable, crops = extract_leaves(img, boxes)
+    return build_result(len(boxes), usable, classify_leaves(crops), scale)
 
+def build_result(num_boxes, usable, preds, scale=1.0):
+    """/predict response from the classifier output for each usable box"""
     healthy, diseased, uncertain = 0, 0, 0
     detections = []
 
     # --- STATE A: No leaf detected ---
-    if results.boxes is None or len(results.boxes) == 0:
+    if num_boxes == 0:
         return {
             "status": "NoLeafDetected",
             "message": "No leaf detected. Please try again with a clearer photo (closer leaf, better lighting).",
@@ -122,16 +415,7 @@ async def predict(file: UploadFile = File(...)):
             "detections": [],
         }
 
-    for box in results.boxes:
-        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy().tolist()
-        det_conf = float(box.conf[0])
-
-        if (x2 - x1) < MIN_BOX_SIZE or (y2 - y1) < MIN_BOX_SIZE:
-            continue
-
-        crop = img.crop((x1, y1, x2, y2))
-        label, cls_conf = classify_leaf(crop)
-
+    for (x1, y1, x2, y2, det_conf), (label, cls_conf) in zip(usable, preds):
         final_label = label
         if cls_conf >= MIN_CLASS_CONF:
             if label == "healthy": healthy += 1
@@ -141,7 +425,7 @@ async def predict(file: UploadFile = File(...)):
             uncertain += 1
 
         detections.append({
-            "bbox": [x1, y1, x2, y2],
+            "bbox": [x1 * scale, y1 * scale, x2 * scale, y2 * scale],
             "confidence": det_conf,
             "leaf_class": final_label,
             "leaf_conf": cls_conf,
@@ -182,4 +466,239 @@ async def predict(file: UploadFile = File(...)):
         },
         "metrics": metrics,
         "detections": detections,
-    }
\ No newline at end of file
+    }
+
+def lookup_cached(image_bytes, tiled=False):
+    """(key, cached_result or None)"""
+    key = cache_key(image_bytes, tiled)
+    return key, result_cache.get(key)
+
+def predict_bytes(image_bytes, key, tiled=False):
+    img, boxes, scale = run_detection(image_bytes, tiled)
+    result = analyze(img, boxes, scale)
+    result_cache.put(key, result)
+    return result
+
+def _read_upload(fileobj):
+    try:
+        fileobj.seek(0)
+        return fileobj.read()
+    finally:
+        fileobj.close()
+
+def _prepare_upload(fileobj, tiled):
+    """Returns (key, cached_result, leaves); leaves is None on a cache hit.
+
+    leaves = (num_boxes, usable_boxes, crops, scale). The decoded image is
+    dropped here, so only the crops wait for classification.
+    """
+    image_bytes = _read_upload(fileobj)
+    key = cache_key(image_bytes, tiled)
+    cached = result_cache.get(key)
+    if cached is not None:
+        return key, cached, None
+    img, boxes, scale = run_detection(image_bytes, tiled)
+    usable, crops = extract_leaves(img, boxes)
+    return key, None, (len(boxes), usable, crops, scale)
+
+def _classify_group(jobs):
+    """Classify the crops of several images in shared CLF_BATCH calls"""
+    todo = [j for j in jobs if "error" not in j and j["result"] is None]
+    try:
+        preds = classify_leaves([crop for j in todo for crop in j["leaves"][2]])
+    except Exception as e:
+        for j in todo:
+            j["error"] = e
+        return
+
+    for j in todo:
+        num_boxes, usable, crops, scale = j.pop("leaves")
+        j["result"] = build_result(num_boxes, usable, preds[:len(crops)], scale)
+        preds = preds[len(crops):]
+        result_cache.put(j["key"], j["result"])
+
+async def spool_multipart(content_type, chunks, field="files", max_files=BATCH_MAX_FILES):
+    """Parse a multipart body as it arrives, writing each `field` file part
+    straight to an unbuffered temp file on disk.
+
+    Returns [(filename, fileobj)]. Memory stays at one network chunk no matter
+    how many or how large the files are. Other fields are ignored.
+    """
+    ctype, params = parse_options_header(content_type)
+    boundary = params.get(b"boundary")
+    if ctype != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=400, detail=f"Expected multipart/form-data with '{field}' file parts")
+
+    uploads = []
+    part = {}
+
+    def on_part_begin():
+        part.clear()
+        part.update(headers={}, name=b"", value=b"", file=None)
+
+    def on_header_field(data, start, end):
+        part["name"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["name"].lower()] = part["value"]
+        part["name"], part["value"] = b"", b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(part["headers"].get(b"content-disposition"))
+        if disposition.get(b"name") != field.encode() or b"filename" not in disposition:
+            return
+        if len(uploads) >= max_files:
+            raise HTTPException(status_code=413, detail=f"At most {max_files} files per batch.")
+        part["file"] = tempfile.TemporaryFile(buffering=0)
+        uploads.append((disposition[b"filename"].decode("utf-8", "replace"), part["file"]))
+
+    def on_part_data(data, start, end):
+        if part["file"] is not None:
+            part["file"].write(data[start:end])
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+    })
+    try:
+        async for chunk in chunks:
+            parser.write(chunk)
+        parser.finalize()
+    except BaseException:
+        for _, fileobj in uploads:
+            fileobj.close()
+        raise
+    return uploads
+
+def stream_batch(uploads, tiled=False):
+    """Yield one NDJSON line per image, then a summary line.
+
+    Decode + detection runs on batch_pool (BATCH_PREFETCH images at a time,
+    up to BATCH_LOOKAHEAD queued). Each step takes the next image plus any
+    later ones that are already detected and classifies all their crops
+    together, so at most BATCH_PREFETCH decoded images and BATCH_LOOKAHEAD
+    sets of crops are alive at any time regardless of batch size (the
+    uploads themselves sit on disk, see spool_multipart).
+    """
+    totals = {"images": len(uploads), "succeeded": 0, "failed": 0,
+              "healthy": 0, "diseased": 0, "uncertain": 0, "total_all": 0}
+    status_counts = {}
+    pending = []
+    next_idx = 0
+
+    try:
+        while next_idx < len(uploads) or pending:
+            while next_idx < len(uploads) and len(pending) < BATCH_LOOKAHEAD:
+                _, fileobj = uploads[next_idx]
+                pending.append((next_idx, batch_pool.submit(_prepare_upload, fileobj, tiled)))
+                next_idx += 1
+
+            # Results stay in upload order: wait for the head, then take whatever is ready behind it
+            group = [pending.pop(0)]
+            wait([group[0][1]])
+            while pending and pending[0][1].done():
+                group.append(pending.pop(0))
+
+            jobs = []
+            for idx, fut in group:
+                job = {"idx": idx}
+                try:
+                    job["key"], job["result"], job["leaves"] = fut.result()
+                except Exception as e:
+                    job["error"] = e
+                jobs.append(job)
+            _classify_group(jobs)
+
+            for job in jobs:
+                line = {"type": "image", "index": job["idx"], "filename": uploads[job["idx"]][0]}
+                if "error" in job:
+                    totals["failed"] += 1
+                    line.update({"status": "Error", "message": str(job["error"])})
+                else:
+                    result = job["result"]
+                    totals["succeeded"] += 1
+                    for key in ("healthy", "diseased", "uncertain", "total_all"):
+                        totals[key] += result["summary"][key]
+                    status_counts[result["status"]] = status_counts.get(result["status"], 0) + 1
+                    line.update(result)
+
+                yield json.dumps(line) + "\n"
+    finally:
+        # Client disconnected or we crashed: don't leave spooled uploads open
+        for idx, fut in pending:
+            if fut.cancel():
+                uploads[idx][1].close()
+        for _, fileobj in uploads[next_idx:]:
+            fileobj.close()
+
+    metrics = compute_metrics(totals["healthy"], totals["diseased"])
+    yield json.dumps({
+        "type": "summary",
+        "summary": {**totals, "total_counted": metrics["counted"]},
+        "metrics": metrics,
+        "status_counts": status_counts,
+    }) + "\n"
+
+# --------------------
+# Routes
+# --------------------
+@app.get("/")
+def root():
+    return {
+        "message": "FLORAI FastAPI running (ONNX Optimized)",
+        "detector": os.path.basename(DET_PATH),
+        "classifier": os.path.basename(CLF_PATH),
+        "conf": DET_CONF,
+        "tile_size": TILE_SIZE,
+        "tile_workers": TILE_WORKERS,
+        "detector_instances": DETECTOR_INSTANCES,
+        "detector_threads": DET_SESSION_THREADS,
+    }
+
+@app.get("/health")
+def health():
+    return {"status": "ok"}
+
+@app.get("/admissionStats")
+def admission_stats():
+    return admission.stats()
+
+@app.get("/cacheStats")
+def cache_stats():
+    return {"model_version": MODEL_VERSION, **result_cache.stats()}
+
+@app.post("/predict")
+async def predict(request: Request, file: UploadFile = File(...), tiled: bool = False):
+    image_bytes = await file.read()
+
+    # Repeat submissions cost only hashing: no inference slot, no queueing
+    key, cached = await run_in_threadpool(lookup_cached, image_bytes, tiled)
+    if cached is not None:
+        return cached
+
+    try:
+        async with admission.slot("/predict", request.scope["headers"]):
+            # Off the event loop, so admission control keeps answering while we infer
+            return await run_in_threadpool(predict_bytes, image_bytes, key, tiled)
+    except Rejected as r:
+        return rejected_response(r)
+
+@app.post("/predictBatch")
+async def predict_batch(request: Request, tiled: bool = False):
+    """multipart/form-data with up to BATCH_MAX_FILES "files" parts -> NDJSON stream.
+
+    The body is parsed here rather than by FastAPI's form handling, which keeps
+    up to 1 MB of every file in memory and caps a form at 1000 files.
+    """
+    uploads = await spool_multipart(request.headers.get("content-type"), request.stream())
+    if not uploads:
+        raise HTTPException(status_code=400, detail="No files uploaded (expected form-data key: 'files')")
+
+    return StreamingResponse(stream_batch(uploads, tiled), media_type="application/x-ndjson")
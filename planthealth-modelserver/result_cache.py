@@ -0,0 +1,188 @@
+# result_cache.py
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+def file_fingerprint(*paths):
+    """Short content hash of the model files, so a new export invalidates the cache"""
+    h = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+class ResultCache:
+    """LRU + TTL cache of JSON-able responses, with an optional on-disk tier.
+
+    Values are stored as JSON text so every hit decodes to a fresh, identical
+    response. The disk tier (one file per key, file mtime = time stored)
+    survives restarts and is shared by workers pointing at the same directory.
+    It holds at most max_disk_entries files: a put that goes over the cap, or
+    comes sweep_interval seconds after the last sweep, deletes expired files
+    and then the oldest ones.
+    """
+
+    def __init__(self, max_entries=256, ttl=3600, disk_dir=None, max_disk_entries=4096, sweep_interval=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+        self.sweep_interval = min(sweep_interval, ttl)
+        self._entries = OrderedDict()  # key -> (stored_at, json_text)
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        self._disk_count = 0
+        self._last_sweep = 0.0
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "puts": 0, "evictions": 0,
+                       "disk_expired": 0, "disk_evictions": 0}
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_sweep(time.time())
+
+    @staticmethod
+    def make_key(image_bytes, *params):
+        h = hashlib.sha256(image_bytes)
+        h.update(json.dumps(params, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[0] <= self.ttl:
+                self._entries.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return json.loads(entry[1])
+            if entry:
+                del self._entries[key]
+
+        found = self._disk_get(key, now)
+        with self._lock:
+            if found is None:
+                self._stats["misses"] += 1
+                return None
+            stored_at, text = found
+            self._stats["disk_hits"] += 1
+            # Keep the original store time so promotion doesn't extend the TTL
+            self._insert(key, stored_at, text)
+        return json.loads(text)
+
+    def put(self, key, value):
+        text = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._stats["puts"] += 1
+            self._insert(key, now, text)
+        self._disk_put(key, text)
+        if self.disk_dir and (self._disk_count > self.max_disk_entries
+                              or now - self._last_sweep >= self.sweep_interval):
+            self._disk_sweep(now)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["disk_entries"] = self._disk_count
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else None
+        stats["max_entries"] = self.max_entries
+        stats["ttl"] = self.ttl
+        stats["disk"] = bool(self.disk_dir)
+        stats["max_disk_entries"] = self.max_disk_entries
+        return stats
+
+    # --- internals ---
+    def _insert(self, key, stored_at, text):
+        # caller holds the lock
+        self._entries[key] = (stored_at, text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key + ".json")
+
+    def _disk_get(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            stored_at = os.path.getmtime(path)
+            if now - stored_at > self.ttl:
+                os.remove(path)
+                with self._lock:
+                    self._disk_count -= 1
+                    self._stats["disk_expired"] += 1
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return stored_at, f.read()
+        except OSError:
+            return None
+
+    def _disk_put(self, key, text):
+        if not self.disk_dir:
+            return
+        tmp = None
+        try:
+            # Write then rename so readers never see a half-written file
+            fd, tmp = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(text)
+            path = self._disk_path(key)
+            is_new = not os.path.exists(path)
+            os.replace(tmp, path)
+            if is_new:
+                with self._lock:
+                    self._disk_count += 1
+        except OSError:
+            if tmp and os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _disk_sweep(self, now):
+        # One sweeper at a time; other callers just skip
+        if not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            files = []
+            expired = 0
+            for entry in os.scandir(self.disk_dir):
+                try:
+                    mtime = entry.stat().st_mtime
+                    if entry.name.endswith(".json") and now - mtime > self.ttl:
+                        os.remove(entry.path)
+                        expired += 1
+                    elif entry.name.endswith(".json"):
+                        files.append((mtime, entry.path))
+                    elif entry.name.endswith(".tmp") and now - mtime > self.ttl:
+                        os.remove(entry.path)  # left behind by a crashed writer
+                except OSError:
+                    continue
+
+            evicted = 0
+            if len(files) > self.max_disk_entries:
+                files.sort()
+                for _, path in files[:len(files) - self.max_disk_entries]:
+                    try:
+                        os.remove(path)
+                        evicted += 1
+                    except OSError:
+                        pass
+
+            with self._lock:
+                self._disk_count = len(files) - evicted
+                self._stats["disk_expired"] += expired
+                self._stats["disk_evictions"] += evicted
+                self._last_sweep = now
+        except OSError:
+            pass
+        finally:
+            self._sweep_lock.release()
@@ -0,0 +1,13 @@
+// Both FastAPI servers deploy from their own folder, so admission.py is copied
+// into each. Fail if the copies drift apart.
+import { readFileSync } from "node:fs";
+
+const copies = ["model_server/admission.py", "planthealth-modelserver/admission.py"];
+const [first, ...rest] = copies.map((path) => readFileSync(path, "utf8"));
+
+if (rest.some((text) => text !== first)) {
+  console.error(`admission.py copies differ: ${copies.join(" vs ")}`);
+  console.error("Edit one and copy it over the other.");
+  process.exit(1);
+}
+console.log("admission.py copies are in sync");